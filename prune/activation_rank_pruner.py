@@ -31,14 +31,149 @@ __all__ = ['ActivationRankPruner', 'ActivationAPoZRankPruner', 'ActivationEntrop
 __author__ = 'YaHei'
 
 
+class _QuantCalibCollector(object):
+    """ Collect per-channel statistics of activations for quantization calibration """
+    def __init__(self, channels, mode='minmax', bins=2048):
+        """
+        :param channels: int
+            The number of channels of activations.
+        :param mode: str, 'minmax' or 'histogram'
+            Collect running min/max, or histograms of absolute values whose range grows with the data.
+        :param bins: int
+            The number of bins for histogram mode.
+        """
+        assert mode in ('minmax', 'histogram'), f'mode should be minmax or histogram, ({mode})'
+        self.mode = mode
+        self.bins = bins
+        self.min = np.full(channels, np.inf)
+        self.max = np.full(channels, -np.inf)
+        self.hist = np.zeros(shape=(channels, bins))
+        self.th = np.zeros(shape=channels)
+        self.batches = 0
+        self.active = True
+
+    def update_range(self, min_, max_):
+        """
+        Update running min/max with per-channel min/max of a batch.
+        Enough for minmax mode, so that activations can be reduced on device before copying.
+        """
+        self.batches += 1
+        self.min = np.minimum(self.min, min_)
+        self.max = np.maximum(self.max, max_)
+
+    def update(self, y):
+        """ Update with a batch of activations in (N, C, H, W) """
+        y = y.swapaxes(0, 1).reshape(y.shape[1], -1)
+        self.update_range(y.min(axis=1), y.max(axis=1))
+        if self.mode == 'histogram':
+            abs_y = np.abs(y)
+            for c, data in enumerate(abs_y):
+                th = max(self.th[c], data.max())
+                if th > self.th[c] and self.th[c] > 0:
+                    # Re-bin the old histogram into the enlarged range
+                    old_edges = np.linspace(0, self.th[c], self.bins + 1)
+                    centers = (old_edges[:-1] + old_edges[1:]) / 2
+                    self.hist[c], _ = np.histogram(centers, bins=self.bins, range=(0, th), weights=self.hist[c])
+                self.th[c] = th
+                if th > 0:
+                    hist, _ = np.histogram(data, bins=self.bins, range=(0, th))
+                    self.hist[c] += hist
+                else:
+                    # All zeros so far, count them in the first bin
+                    self.hist[c, 0] += data.size
+
+    def thresholds(self, percentile=99.99):
+        """
+        Get per-channel (min, max) thresholds.
+        :param percentile: float
+            Only for histogram mode, clip the absolute values at the percentile of distribution.
+        :return: (numpy.ndarray, numpy.ndarray)
+        """
+        if self.mode == 'minmax':
+            return self.min, self.max
+        cdf = np.cumsum(self.hist, axis=1)
+        total = np.maximum(cdf[:, -1:], 1)
+        idx = (cdf / total < percentile / 100).sum(axis=1)
+        th = (np.minimum(idx, self.bins - 1) + 1) * self.th / self.bins
+        return np.maximum(self.min, -th), np.minimum(self.max, th)
+
+
 class ActivationRankPruner(Pruner):
     def __init__(self, pruned_conv, mask_output, act_blk):
         super(ActivationRankPruner, self).__init__(pruned_conv, mask_output)
         self.act_blk = act_blk
 
+        self.quant_calib = None
+        def _hook(m, x, y):
+            if self.is_quant_calib_active() and not autograd.is_training():
+                if self.quant_calib.mode == 'minmax':
+                    self.quant_calib.update_range(y.min(axis=(0, 2, 3)).asnumpy(), y.max(axis=(0, 2, 3)).asnumpy())
+                else:
+                    self.quant_calib.update(y.asnumpy())
+        act_blk.register_forward_hook(_hook)
+
+    def enable_quant_calib(self, mode='minmax', bins=2048):
+        """
+        Collect statistics for quantization in the same pass as calibration for pruning.
+        :param mode: str, 'minmax' or 'histogram'
+            The kind of statistics to collect per channel.
+        :param bins: int
+            The number of bins for histogram mode.
+        """
+        self.quant_calib = _QuantCalibCollector(self._channels, mode, bins)
+
+    def stop_quant_calib(self):
+        """
+        Stop collecting statistics for quantization but keep them for export.
+        Called by prune_by_percent(), since activations of the masked net no longer match the calibration pass.
+        """
+        if self.quant_calib is not None:
+            self.quant_calib.active = False
+
+    def resume_quant_calib(self):
+        """ Resume collecting statistics for quantization """
+        if self.quant_calib is not None:
+            self.quant_calib.active = True
+
+    def is_quant_calib_active(self):
+        """ Whether statistics for quantization are still being collected """
+        return self.quant_calib is not None and self.quant_calib.active
+
+    def disable_quant_calib(self):
+        """ Stop collecting statistics for quantization and drop them """
+        self.quant_calib = None
+
+    def export_quant_calib(self, percentile=99.99):
+        """
+        Export thresholds for the kept channels only, which matches the layout of compacted network.
+        Note that only the outputs of act_blk are covered, and the statistics come from the unpruned net,
+        so layers downstream of pruned channels may see different ranges in the compacted net.
+        :param percentile: float
+            Only for histogram mode, refer to _QuantCalibCollector.thresholds()
+        :return: dict
+            kept: list of int, indices of kept channels in origin layer
+            min/max: list of float, per-channel thresholds of kept channels
+            tensor_min/tensor_max: float, per-tensor thresholds over kept channels
+        """
+        assert self.quant_calib is not None, "Please run enable_quant_calib() before the calibration pass."
+        assert self.quant_calib.batches > 0, "No statistics for quantization, please run the calibration pass."
+        mask = self.share_mask.mask if self.share_mask is not None else self.mask
+        kept = np.nonzero(mask.asnumpy().reshape(-1))[0]
+        min_, max_ = self.quant_calib.thresholds(percentile)
+        min_, max_ = min_[kept], max_[kept]
+        return {
+            'kept': kept.tolist(),
+            'min': min_.tolist(),
+            'max': max_.tolist(),
+            'tensor_min': float(min_.min()) if kept.size > 0 else 0.,
+            'tensor_max': float(max_.max()) if kept.size > 0 else 0.,
+        }
+
 
 class ActivationAPoZRankPruner(ActivationRankPruner):
     """ Reference: https://arxiv.org/abs/1607.03250 """
+    criterion = 'apoz'
+
     def __init__(self, pruned_conv, mask_output, act_blk):
         """ APoZ-rank pruner, refer to Pruner """
         super(ActivationAPoZRankPruner, self).__init__(pruned_conv, mask_output, act_blk)
@@ -48,6 +183,7 @@ class ActivationAPoZRankPruner(ActivationRankPruner):
         def _hook(m, x, y):
             if not autograd.is_training():
                 batch_mean = (y == 0).mean(axis=(2, 3)).asnumpy()
+                self._batches += 1
                 for mean in batch_mean:
                     self.APoZs = 0.01 * mean + 0.99 * self.APoZs
         act_blk.register_forward_hook(_hook)
@@ -58,6 +194,11 @@ class ActivationAPoZRankPruner(ActivationRankPruner):
         Called at the begin of evaluation.
         """
         self.APoZs = np.zeros(shape=self._channels)
+        self._batches = 0
+
+    def _compute_apoz(self):
+        assert self._batches > 0, "No APoZ collected, please run the calibration pass before pruning."
+        return self.APoZs
 
     def prune_by_percent(self, p):
         """
@@ -66,9 +207,10 @@ class ActivationAPoZRankPruner(ActivationRankPruner):
         :param p: float < 1.0
             The percent of filters to prune.
         """
+        self.stop_quant_calib()
         ctx = self.pruned_conv.weight.list_ctx()[0]
-        APoZs = np.concatenate(self.APoZs, axis=0)
-        mean = APoZs.mean(aixs=0)
+        mean = self._load_or_compute_ranking(lambda: {'rank': self._compute_apoz()})['rank']
+        self.clear_state()
         th_idx = np.argsort(mean)[int((1-p) * self._channels)]
         mask = (mean < mean[th_idx]).reshape(1, -1, 1, 1)
         self.mask = nd.array(mask, ctx=ctx)
@@ -76,6 +218,8 @@ class ActivationAPoZRankPruner(ActivationRankPruner):
 
 class ActivationEntropyRankPruner(ActivationRankPruner):
     """ Reference: http://arxiv.org/abs/1706.05791 """
+    criterion = 'entropy'
+
     def __init__(self, pruned_conv, mask_output, act_blk):
         """ Entropy-rank pruner, refer to Pruner """
         super(ActivationEntropyRankPruner, self).__init__(pruned_conv, mask_output, act_blk)
@@ -88,7 +232,15 @@ class ActivationEntropyRankPruner(ActivationRankPruner):
                 self.global_means.append(mean)
         act_blk.register_forward_hook(_hook)
 
+    def clear_state(self):
+        """ Clear the collected means of activations """
+        self.global_means.clear()
+
+    def _criterion(self, bins=100, **kwargs):
+        return f'{self.criterion}-{bins}'
+
     def _compute_entropy_and_clear(self, bins=100):
+        assert len(self.global_means) > 0, "No activations collected, please run the calibration pass before pruning."
         global_mean_np = np.concatenate(self.global_means, axis=0)
         min_ = np.min(global_mean_np, axis=0, keepdims=True)
         max_ = np.max(global_mean_np, axis=0, keepdims=True)
@@ -99,6 +251,7 @@ class ActivationEntropyRankPruner(ActivationRankPruner):
         for bin in data2bin.swapaxes(0, 1):
             count = np.bincount(bin, minlength=bins)
             prob = count.astype("float32") / bin.size
+            prob = prob[prob > 0]
             entropys.append(-sum(prob * np.log(prob)))
 
         self.global_means.clear()
@@ -113,9 +266,12 @@ class ActivationEntropyRankPruner(ActivationRankPruner):
         :param bins: int
             The number of bins to calculate probability distribution.
         """
+        self.stop_quant_calib()
         ctx = self.pruned_conv.weight.list_ctx()[0]
-        entropys = self._compute_entropy_and_clear(bins)
+        entropys = self._load_or_compute_ranking(lambda: {'rank': self._compute_entropy_and_clear(bins)},
+                                                 bins=bins)['rank']
+        self.global_means.clear()
         th_idx = np.argsort(entropys)[int(p * self._channels)]
-        mask = (entropys >= th_idx).reshape(1, -1, 1, 1)
+        mask = (entropys >= entropys[th_idx]).reshape(1, -1, 1, 1)
         self.mask = nd.array(mask, ctx=ctx)
 
@@ -54,6 +54,8 @@ class GradientRankPruner(Pruner):
 
 class GradientTaylorRankPruner(GradientRankPruner):
     """ Reference: https://arxiv.org/abs/1611.06440 """
+    criterion = 'taylor'
+
     def __init__(self, pruned_conv, mask_output):
         super(GradientTaylorRankPruner, self).__init__(pruned_conv, mask_output)
         self.default_prune = self.prune_by_percent
@@ -68,6 +70,10 @@ class GradientTaylorRankPruner(GradientRankPruner):
         pruned_conv.origin_forward = pruned_conv.hybrid_forward
         pruned_conv.hybrid_forward = types.MethodType(_forward, pruned_conv)
 
+    def clear_state(self):
+        """ Clear the collected taylor criterions """
+        self.taylors.clear()
+
     def update_state(self):
         y = self.y[0].asnumpy()
         dy = self.dy[0].asnumpy()
@@ -75,6 +81,7 @@ class GradientTaylorRankPruner(GradientRankPruner):
         self.taylors.append(taylor)
 
     def _compute_mean_taylor_and_clear(self):
+        assert len(self.taylors) > 0, "No taylor criterions collected, please run update_state() before pruning."
         taylors = np.concatenate(self.taylors, axis=0)
         mean = taylors.mean(axis=0)
         self.taylors.clear()
@@ -82,9 +89,10 @@ class GradientTaylorRankPruner(GradientRankPruner):
 
     def prune_by_percent(self, p):
         ctx = self.pruned_conv.weight.list_ctx()[0]
-        taylors = self._compute_mean_taylor_and_clear()
+        taylors = self._load_or_compute_ranking(lambda: {'rank': self._compute_mean_taylor_and_clear()})['rank']
+        self.taylors.clear()
         th_idx = np.argsort(taylors)[int(p * self._channels)]
-        mask = (taylors >= th_idx).reshape(1, -1, 1, 1)
+        mask = (taylors >= taylors[th_idx]).reshape(1, -1, 1, 1)
         self.mask = nd.array(mask, ctx=ctx)
 
 
@@ -102,6 +110,7 @@ class GradientWeightRankPruner(GradientRankPruner):
 
     def prune_by_percent(self, p):
         criterion = self._compute_criterion()
-        th_idx = nd.argsort(criterion)[int(p * self._channels)]
-        self.mask = (criterion >= th_idx).reshape(1, -1, 1, 1)
+        th_idx = nd.argsort(criterion)[int(p * self._channels)].asscalar()
+        th = criterion[int(th_idx)].asscalar()
+        self.mask = (criterion >= th).reshape(1, -1, 1, 1)
 
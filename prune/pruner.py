@@ -21,7 +21,9 @@
 # OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
 # SOFTWARE.
 
+import json
 import types
+import hashlib
 
 from mxnet import nd, autograd
 
@@ -43,6 +45,11 @@ class _ChannelMask(autograd.Function):
 
 
 class Pruner(object):
+    # Name of ranking criterion used as part of the key for rank cache, None if not cacheable
+    criterion = None
+    # Whether the ranking is computed from weights only (needs no calibration pass)
+    data_free = False
+
     def __init__(self, pruned_conv, mask_output, share_mask=None):
         """
         Filter-level pruner for convolution layers.
@@ -58,6 +65,10 @@ class Pruner(object):
         self.mask_output = mask_output
         self.share_mask = share_mask
         self._channels = pruned_conv.weight.shape[0]
+        self.rank_cache = None
+        self.calib_id = None
+        self._digest = None
+        self._cached_ranking = None
 
         """ Initialize a mask if not share """
         if share_mask is None:
@@ -101,6 +112,86 @@ class Pruner(object):
 
         return (pc, oc), (pruned_params, total_params), (pruned_mac, total_mac)
 
+    def set_rank_cache(self, cache, calib_id=None):
+        """
+        Share rankings across experiments via a cache.
+        Note that data-dependent criterions are only cached with both calib_id and a digest of net state,
+        refer to bind_digest().
+        :param cache: prune.utils.RankCache
+            The cache to load and store rankings, None to disable.
+        :param calib_id: str
+            The identity of calibration set, ignored by data-free criterions.
+        """
+        self.rank_cache = cache
+        self.calib_id = calib_id
+        self._digest = None
+        self._cached_ranking = None
+
+    def bind_digest(self, digest):
+        """
+        Bind the digest of net state (parameters and masks) at calibration to the key,
+        because activations depend on all the parameters and masks in front of a layer.
+        The digest is consumed by the next pruning. Usually called by PrunerManager.
+        :param digest: str, or None to unbind
+        """
+        self._digest = digest
+
+    def clear_state(self):
+        """ Clear the statistics collected for ranking """
+        pass
+
+    def _criterion(self, **kwargs):
+        """ The full name of criterion, including hyper-parameters which affect the ranking """
+        return self.criterion
+
+    def _ranking_key(self, **kwargs):
+        if self.rank_cache is None or self.criterion is None:
+            return None
+        if self.data_free:
+            calib_id = None
+        elif self.calib_id is None or self._digest is None:
+            return None
+        else:
+            calib_id = f'{self.calib_id}:{self._digest}'
+        weight = self.pruned_conv.weight.data().asnumpy()
+        return self.rank_cache.make_key(weight, self._criterion(**kwargs), calib_id)
+
+    def is_ranking_cached(self, **kwargs):
+        """
+        Check whether the ranking can be loaded from cache, so that the calibration pass could be skipped.
+        The entry is held in memory until the next pruning, so that it can't be evicted in between.
+        :param kwargs: hyper-parameters of criterion, refer to _criterion()
+        """
+        key = self._ranking_key(**kwargs)
+        if key is None:
+            return False
+        entry = self.rank_cache.get(key)
+        self._cached_ranking = (key, entry) if entry is not None else None
+        return entry is not None
+
+    def _load_or_compute_ranking(self, compute, **kwargs):
+        """
+        Load ranking from cache if hit, otherwise compute and store it.
+        :param compute: func() -> dict of numpy.ndarray
+            Should raise if no statistics were collected.
+        :param kwargs: hyper-parameters of criterion, refer to _criterion()
+        :return: dict of numpy.ndarray
+        """
+        key = self._ranking_key(**kwargs)
+        cached, self._cached_ranking = self._cached_ranking, None
+        if not self.data_free:
+            self._digest = None
+        if key is not None:
+            if cached is not None and cached[0] == key:
+                return cached[1]
+            entry = self.rank_cache.get(key)
+            if entry is not None:
+                return entry
+        entry = compute()
+        if key is not None:
+            self.rank_cache.put(key, **entry)
+        return entry
+
     def default_prune(self):
         """ The default pruning API """
         raise NotImplementedError()
@@ -119,6 +210,11 @@ class PrunerManager(object):
         self.out_size = {}
         # Net
         self._net = net
+        # Pending hooks to infer in_channels
+        self._in_channels_hooks = []
+        # Whether rankings are cached, and hook to bind digest of net at calibration
+        self._rank_cached = False
+        self._digest_hook = None
 
     def build(self, in_shape):
         """
@@ -157,14 +253,100 @@ class PrunerManager(object):
         for pruner in self.pruner_list:
             func(pruner)
 
+    def set_rank_cache(self, cache, calib_id=None):
+        """
+        Share rankings of all pruners across experiments via a cache.
+        :param cache: prune.utils.RankCache
+            The cache to load and store rankings, None to disable.
+        :param calib_id: str
+            The identity of calibration set. Data-dependent criterions are not cached if None.
+        """
+        self.apply(lambda pruner: pruner.set_rank_cache(cache, calib_id))
+        self._rank_cached = cache is not None
+        if self._rank_cached and self._digest_hook is None:
+            def _hook(m, x):
+                if not isinstance(x[0], nd.NDArray):
+                    return
+                if autograd.is_training():
+                    # Parameters are going to change
+                    self.apply(lambda pruner: pruner.bind_digest(None))
+                else:
+                    # Begin of calibration, digest once for all pruners
+                    self._bind_digest(force=False)
+            self._digest_hook = self._net.register_forward_pre_hook(_hook)
+
+    def _calib_pruners(self):
+        return [pruner for pruner in self.pruner_list if not pruner.data_free and pruner.share_mask is None]
+
+    def _bind_digest(self, force=True):
+        """ Compute digest of net once and bind it to pruners """
+        if not self._rank_cached:
+            return
+        if force or any(pruner._digest is None for pruner in self._calib_pruners()):
+            digest = self.net_digest()
+            self.apply(lambda pruner: pruner.bind_digest(digest))
+
+    def net_digest(self):
+        """
+        Digest of all the parameters and masks of net.
+        The prefix of net is stripped from names, so that the same checkpoint loaded into
+        another instance of net gets the same digest.
+        """
+        prefix = self._net.prefix
+        params = [(name[len(prefix):] if name.startswith(prefix) else name, param)
+                  for name, param in self._net.collect_params().items()]
+        h = hashlib.sha1()
+        for name, param in sorted(params, key=lambda x: x[0]):
+            h.update(name.encode())
+            h.update(param.data().asnumpy().tobytes())
+        for pruner in self.pruner_list:
+            if pruner.mask is not None:
+                h.update(pruner.mask.asnumpy().astype('uint8').tobytes())
+        return h.hexdigest()
+
+    def reset_masks(self):
+        """
+        Reset all masks to ones and clear the statistics of pruners,
+        e.g. before each point of a sweep over pruning ratios,
+        so that every point is calibrated on (and hits the cached rankings of) the unpruned net.
+        """
+        for pruner in self.pruner_list:
+            if pruner.share_mask is None:
+                pruner.mask = nd.ones_like(pruner.mask)
+            pruner.bind_digest(None)
+            pruner.clear_state()
+        self.infer_in_channels_at_next_batch()
+
+    def rankings_cached(self, **kwargs):
+        """
+        Check whether all the rankings can be loaded from cache.
+        If True, the calibration pass before prune() could be skipped.
+        Always False while statistics for quantization are being collected, which still need the pass.
+        :param kwargs: hyper-parameters of criterions, refer to Pruner._criterion()
+        """
+        self._bind_digest()
+        for pruner in self.pruner_list:
+            if getattr(pruner, 'is_quant_calib_active', lambda: False)():
+                return False
+        for pruner in self._calib_pruners():
+            if not pruner.is_ranking_cached(**kwargs):
+                return False
+        return True
+
     def prune(self, *args, **kwargs):
         """ Apply prune via default_prune APIs """
+        # Digest before any mask changes
+        self._bind_digest(force=False)
         for pruner in self.pruner_list:
             pruner.default_prune(*args, **kwargs)
         self.infer_in_channels_at_next_batch()
 
     def infer_in_channels_at_next_batch(self):
         """ Infer the real number of in_channels via input_data at next batch """
+        # Drop hooks which haven't been fired yet
+        for hook in self._in_channels_hooks:
+            hook.detach()
+        self._in_channels_hooks = []
         def _add_hook(pruner):
             hook = None
             def _infer_pre_hook(m, x):
@@ -174,6 +356,7 @@ class PrunerManager(object):
                 pruner.in_channels = (x_sum != 0).sum().asscalar()
                 hook.detach()
             hook = pruner.pruned_conv.register_forward_pre_hook(_infer_pre_hook)
+            self._in_channels_hooks.append(hook)
         self.apply(_add_hook)
 
     def analyse(self):
@@ -204,8 +387,50 @@ class PrunerManager(object):
             reg.append(_ChannelMask(mask.reshape(-1))(square_sum).sum())
         return sum(reg)
 
+    def export_quant_calib_table(self, fname=None, percentile=99.99, sym_mapper=None):
+        """
+        Export quantization calibration table for the compacted network,
+        from statistics collected by pruners with enable_quant_calib().
+        Only the outputs of act_blk of activation pruners are covered; other layers still need their own calibration.
+        :param fname: str
+            If not None, dump the table to the file as json.
+        :param percentile: float
+            Only for histogram mode, clip the absolute values at the percentile of distribution.
+        :param sym_mapper: CrossMapper
+            Mapper from gluon blocks to symbol names, refer to prune.utils.get_gluon_symbol_mapper().
+            Note that it should be created before pruners, which patch the blocks for NDArray only.
+            If None, take '{act_blk.prefix}fwd' as symbol name, which is used by gluon activation blocks.
+        :return: dict
+            th_dict: {'<symbol>_output': (min, max)}, per-tensor thresholds accepted by MXNet quantization
+            per_channel: {'<symbol>_output': dict}, refer to ActivationRankPruner.export_quant_calib()
+        """
+        th_dict = {}
+        per_channel = {}
+        for pruner in self.pruner_list:
+            if getattr(pruner, 'quant_calib', None) is None:
+                continue
+            if sym_mapper is not None:
+                sym_name = sym_mapper.get_symbol_name(pruner.act_blk)
+            else:
+                sym_name = f'{pruner.act_blk.prefix}fwd'
+            name = f'{sym_name}_output'
+            calib = pruner.export_quant_calib(percentile)
+            th_dict[name] = (calib['tensor_min'], calib['tensor_max'])
+            per_channel[name] = calib
+        table = {'th_dict': th_dict, 'per_channel': per_channel}
+        if fname is not None:
+            with open(fname, 'w') as f:
+                json.dump(table, f, indent=2)
+        return table
+
     def _get_outsize(self, in_shape):
         """ Collect the output shape of feature maps """
+        # The forward pass with zeros is not a calibration batch for quantization
+        collecting = [pruner for pruner in self.pruner_list
+                      if getattr(pruner, 'is_quant_calib_active', lambda: False)()]
+        for pruner in collecting:
+            pruner.stop_quant_calib()
+
         hooks = []
         for pruner in self.pruner_list:
             def _generate_hook(pruner):
@@ -222,3 +447,5 @@ class PrunerManager(object):
 
         for h in hooks:
             h.detach()
+        for pruner in collecting:
+            pruner.resume_quant_calib()
@@ -1,3 +1,5 @@
 #-*- coding: utf-8 -*-
 
 from .mapper import *
+
+from .cache import *
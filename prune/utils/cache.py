@@ -0,0 +1,143 @@
+#-*- coding: utf-8 -*-
+# MIT License
+#
+# Copyright (c) 2019 hey-yahei
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+
+import os
+import hashlib
+import numpy as np
+
+__all__ = ['RankCache']
+__author__ = 'YaHei'
+
+
+class RankCache(object):
+    """ Content-addressed cache of channel rankings on disk, with size-bounded LRU eviction """
+    def __init__(self, root, max_bytes=64 * 1024 * 1024):
+        """
+        Store rankings as .npz files under root.
+        Entries are keyed by a hash of layer weights, criterion type and calibration-set identity,
+        so that experiments from the same pretrained checkpoint can share the statistics.
+        example:
+            > cache = RankCache("~/.fpruning/rank_cache")
+            > key = cache.make_key(conv.weight.data().asnumpy(), "apoz", "cifar10-train-1024")
+            > cache.put(key, rank=apozs)
+            > cache.get(key)["rank"]
+        :param root: str
+            The directory to store entries.
+        :param max_bytes: int
+            The upper bound of total size of entries. The least recently used entries are evicted beyond it.
+        """
+        self.root = os.path.expanduser(root)
+        self.max_bytes = max_bytes
+        os.makedirs(self.root, exist_ok=True)
+
+    @staticmethod
+    def make_key(weight, criterion, calib_id=None):
+        """
+        Build a key for cache.
+        :param weight: numpy.ndarray
+            The weight of pruned convolution.
+        :param criterion: str
+            The name of ranking criterion.
+        :param calib_id: str
+            The identity of calibration set. None for data-free criterions.
+        :return: str
+            Hex digest as key.
+        """
+        weight = np.ascontiguousarray(weight)
+        h = hashlib.sha1()
+        h.update(str(weight.dtype).encode())
+        h.update(str(weight.shape).encode())
+        h.update(weight.tobytes())
+        h.update(f'|{criterion}|{calib_id}'.encode())
+        return h.hexdigest()
+
+    def _path(self, key):
+        return os.path.join(self.root, f'{key}.npz')
+
+    def __contains__(self, key):
+        return os.path.exists(self._path(key))
+
+    def get(self, key):
+        """
+        Load an entry and mark it as recently used.
+        :param key: str
+        :return: dict of numpy.ndarray, or None if missing
+        """
+        path = self._path(key)
+        try:
+            with np.load(path) as f:
+                entry = {name: f[name] for name in f.files}
+        except (IOError, OSError, ValueError):
+            return None
+        try:
+            os.utime(path, None)
+        except OSError:
+            pass
+        return entry
+
+    def put(self, key, **arrays):
+        """
+        Save an entry and evict the least recently used ones if over size.
+        :param key: str
+        :param arrays: numpy.ndarray
+            Named arrays to store.
+        """
+        path = self._path(key)
+        tmp_path = f'{path}.{os.getpid()}.tmp'
+        with open(tmp_path, 'wb') as f:
+            np.savez(f, **arrays)
+        os.replace(tmp_path, path)
+        self._evict(keep=path)
+
+    def clear(self):
+        """ Remove all entries """
+        for path, _, _ in self._entries():
+            os.remove(path)
+
+    def _entries(self):
+        entries = []
+        for name in os.listdir(self.root):
+            if not name.endswith('.npz'):
+                continue
+            path = os.path.join(self.root, name)
+            try:
+                st = os.stat(path)
+            except OSError:
+                continue
+            entries.append((path, st.st_mtime, st.st_size))
+        return entries
+
+    def _evict(self, keep=None):
+        """ Evict the least recently used entries until the total size is within max_bytes """
+        entries = sorted(self._entries(), key=lambda e: e[1])
+        total = sum(size for _, _, size in entries)
+        for path, _, size in entries:
+            if total <= self.max_bytes:
+                break
+            if path == keep:
+                continue
+            try:
+                os.remove(path)
+            except OSError:
+                pass
+            total -= size
@@ -35,6 +35,9 @@ WeightRankPruner = Pruner
 
 class WeightL1RankPruner(WeightRankPruner):
     """ Reference: https://arxiv.org/abs/1608.08710 """
+    criterion = 'l1'
+    data_free = True
+
     def __init__(self, pruned_conv, mask_output, share_mask=None):
         """ L1-rank pruner, refer to Pruner """
         super(WeightL1RankPruner, self).__init__(pruned_conv, mask_output, share_mask)
@@ -51,8 +54,10 @@ class WeightL1RankPruner(WeightRankPruner):
             return
 
         ctx = self.pruned_conv.weight.list_ctx()[0]
-        weight = self.pruned_conv.weight.data()
-        th = np.std(weight.asnumpy()) * s
-        th = nd.array([th], ctx=ctx)
-        abs_mean = weight.abs().mean(axis=(1, 2, 3))
+        def _compute():
+            weight = self.pruned_conv.weight.data().asnumpy()
+            return {'rank': np.abs(weight).mean(axis=(1, 2, 3)), 'std': np.array(np.std(weight))}
+        entry = self._load_or_compute_ranking(_compute)
+        th = float(entry['std']) * s
+        abs_mean = nd.array(entry['rank'], ctx=ctx)
         self.mask = (abs_mean >= th).reshape(1, -1, 1, 1)
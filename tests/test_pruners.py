@@ -0,0 +1,65 @@
+#-*- coding: utf-8 -*-
+import pytest
+
+np = pytest.importorskip('numpy')
+pytest.importorskip('mxnet')
+
+from mxnet import nd
+from mxnet.gluon import nn
+
+from prune import (ActivationAPoZRankPruner, ActivationEntropyRankPruner,
+                   GradientTaylorRankPruner, GradientWeightRankPruner)
+
+
+def _build_blocks():
+    conv = nn.Conv2D(4, 3, in_channels=3)
+    bn = nn.BatchNorm(in_channels=4)
+    act = nn.Activation('relu')
+    conv.initialize()
+    bn.initialize()
+    return conv, bn, act
+
+
+def _mask(pruner):
+    return pruner.mask.asnumpy().reshape(-1).astype('int32').tolist()
+
+
+def test_apoz_prunes_large_apoz():
+    pruner = ActivationAPoZRankPruner(*_build_blocks())
+    pruner.APoZs = np.array([.9, .1, .5, .3])
+    pruner._batches = 1
+    pruner.prune_by_percent(.5)
+    assert _mask(pruner) == [0, 1, 0, 1]
+
+
+def test_entropy_prunes_small_entropy():
+    pruner = ActivationEntropyRankPruner(*_build_blocks())
+    n = 1000
+    rng = np.random.RandomState(0)
+    means = np.stack([
+        rng.uniform(0, 1, n),                               # ~log(100)
+        np.concatenate([np.zeros(n - 2), [0., 1.]]),        # ~0
+        np.tile([0., 1.], n // 2),                          # log(2)
+        np.tile(np.arange(10) / 9., n // 10),               # log(10)
+    ], axis=1)
+    pruner.global_means.append(means)
+    pruner.prune_by_percent(.5)
+    assert _mask(pruner) == [1, 0, 0, 1]
+
+
+def test_taylor_prunes_small_taylor():
+    conv, bn, _ = _build_blocks()
+    pruner = GradientTaylorRankPruner(conv, bn)
+    pruner.taylors.append(np.array([[.1, -.9, .5, .3]]))
+    pruner.prune_by_percent(.5)
+    assert _mask(pruner) == [0, 1, 1, 0]
+
+
+def test_gradient_weight_prunes_small_criterion():
+    conv, bn, _ = _build_blocks()
+    pruner = GradientWeightRankPruner(conv, bn)
+    shape = conv.weight.shape
+    conv.weight.set_data(nd.ones(shape))
+    conv.weight.grad()[:] = nd.array([.1, -.9, .5, .3]).reshape((4, 1, 1, 1)).broadcast_to(shape)
+    pruner.prune_by_percent(.5)
+    assert _mask(pruner) == [0, 1, 1, 0]
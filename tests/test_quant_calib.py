@@ -0,0 +1,104 @@
+#-*- coding: utf-8 -*-
+import json
+
+import pytest
+
+np = pytest.importorskip('numpy')
+pytest.importorskip('mxnet')
+
+from mxnet import nd
+from mxnet.gluon import nn
+
+from prune import ActivationAPoZRankPruner, PrunerManager
+from prune.activation_rank_pruner import _QuantCalibCollector
+
+
+def _build_manager():
+    net = nn.HybridSequential()
+    with net.name_scope():
+        net.add(nn.Conv2D(4, 3, padding=1, in_channels=3), nn.BatchNorm(in_channels=4), nn.Activation('relu'))
+    net.initialize()
+    manager = PrunerManager(net)
+    manager.add(ActivationAPoZRankPruner(net[0], net[1], net[2]))
+    return net, manager
+
+
+def test_minmax_update_range():
+    calib = _QuantCalibCollector(2)
+    calib.update_range(np.array([0., -1.]), np.array([1., 2.]))
+    calib.update_range(np.array([-3., 0.]), np.array([.5, 4.]))
+    assert calib.batches == 2
+    min_, max_ = calib.thresholds()
+    np.testing.assert_array_equal(min_, [-3., -1.])
+    np.testing.assert_array_equal(max_, [1., 4.])
+
+
+def test_histogram_counts_zeros_in_first_bin():
+    calib = _QuantCalibCollector(1, mode='histogram', bins=4)
+    calib.update(np.zeros((10, 1, 1, 1)))
+    assert calib.th[0] == 0
+    np.testing.assert_array_equal(calib.hist[0], [10, 0, 0, 0])
+    calib.update(np.ones((2, 1, 1, 1)))
+    np.testing.assert_array_equal(calib.hist[0], [10, 0, 0, 2])
+
+
+def test_histogram_rebins_when_range_grows():
+    calib = _QuantCalibCollector(1, mode='histogram', bins=4)
+    calib.update(np.full((3, 1, 1, 1), .5))
+    np.testing.assert_array_equal(calib.hist[0], [0, 0, 0, 3])
+    calib.update(np.full((2, 1, 1, 1), 1.))
+    assert calib.th[0] == 1.
+    # Center of the old last bin (.4375) falls into [.25, .5)
+    np.testing.assert_array_equal(calib.hist[0], [0, 3, 0, 2])
+
+
+def test_histogram_percentile_thresholds():
+    calib = _QuantCalibCollector(1, mode='histogram', bins=10)
+    calib.update(np.array([.05] * 9 + [1.]).reshape(10, 1, 1, 1))
+    min_, max_ = calib.thresholds(percentile=80)
+    np.testing.assert_allclose(min_, [.05])
+    np.testing.assert_allclose(max_, [.1])
+    _, max_ = calib.thresholds(percentile=100)
+    np.testing.assert_allclose(max_, [1.])
+
+
+def test_build_is_not_a_calibration_batch():
+    _, manager = _build_manager()
+    pruner = manager.pruner_list[0]
+    pruner.enable_quant_calib()
+    manager.build((2, 3, 8, 8))
+    assert pruner.quant_calib.batches == 0
+    assert pruner.is_quant_calib_active()
+
+
+def test_minmax_hook_reduces_per_channel():
+    net, manager = _build_manager()
+    manager.build((2, 3, 8, 8))
+    pruner = manager.pruner_list[0]
+    pruner.enable_quant_calib()
+    y = net[2](net[1](net[0](nd.random.uniform(-1, 1, shape=(2, 3, 8, 8))))).asnumpy()
+    min_, max_ = pruner.quant_calib.thresholds()
+    np.testing.assert_allclose(min_, y.min(axis=(0, 2, 3)))
+    np.testing.assert_allclose(max_, y.max(axis=(0, 2, 3)))
+
+
+def test_export_kept_channels_only(tmp_path):
+    net, manager = _build_manager()
+    manager.build((2, 3, 8, 8))
+    pruner = manager.pruner_list[0]
+    pruner.enable_quant_calib()
+    with pytest.raises(AssertionError):
+        manager.export_quant_calib_table()
+
+    pruner.quant_calib.update_range(np.array([0., 0., 0., 0.]), np.array([1., 2., 3., 4.]))
+    pruner.mask = nd.array([1, 0, 1, 0]).reshape((1, -1, 1, 1))
+    fname = str(tmp_path / 'calib.json')
+    table = manager.export_quant_calib_table(fname)
+
+    name = f'{net[2].prefix}fwd_output'
+    assert table['th_dict'] == {name: (0., 3.)}
+    calib = table['per_channel'][name]
+    assert calib['kept'] == [0, 2]
+    assert calib['max'] == [1., 3.]
+    with open(fname) as f:
+        assert json.load(f)['th_dict'][name] == [0., 3.]
@@ -0,0 +1,151 @@
+#-*- coding: utf-8 -*-
+import os
+
+import pytest
+
+np = pytest.importorskip('numpy')
+pytest.importorskip('mxnet')
+
+from mxnet import nd
+from mxnet.gluon import nn
+
+from prune import ActivationAPoZRankPruner, PrunerManager, WeightL1RankPruner
+from prune.utils import RankCache
+
+
+def _set_mtime(cache, key, t):
+    for name in os.listdir(cache.root):
+        if name.startswith(key):
+            os.utime(os.path.join(cache.root, name), (t, t))
+
+
+def test_round_trip(tmp_path):
+    cache = RankCache(str(tmp_path))
+    rank = np.arange(8, dtype='float32')
+    cache.put('k', rank=rank, std=np.array(.5))
+    assert 'k' in cache
+    entry = cache.get('k')
+    np.testing.assert_array_equal(entry['rank'], rank)
+    assert float(entry['std']) == .5
+    assert cache.get('missing') is None
+
+
+def test_lru_eviction_order(tmp_path):
+    cache = RankCache(str(tmp_path))
+    for i, key in enumerate(['a', 'b', 'c']):
+        cache.put(key, rank=np.zeros(256))
+        _set_mtime(cache, key, 1000 + i)
+    # Touch 'a' so that 'b' becomes the least recently used
+    cache.get('a')
+    size = sum(os.path.getsize(os.path.join(cache.root, name)) for name in os.listdir(cache.root)) // 3
+    cache.max_bytes = 3 * size
+    cache.put('d', rank=np.zeros(256))
+    assert 'b' not in cache
+    assert all(key in cache for key in ['a', 'c', 'd'])
+
+
+def test_evict_keeps_new_entry(tmp_path):
+    cache = RankCache(str(tmp_path), max_bytes=1)
+    cache.put('a', rank=np.zeros(16))
+    _set_mtime(cache, 'a', 1000)
+    cache.put('b', rank=np.zeros(16))
+    assert 'a' not in cache
+    assert 'b' in cache
+
+
+def test_make_key_sensitivity():
+    w = np.random.rand(4, 3, 3, 3).astype('float32')
+    key = RankCache.make_key(w, 'apoz', 'calib')
+    assert key == RankCache.make_key(w.copy(), 'apoz', 'calib')
+    w2 = w.copy()
+    w2[0, 0, 0, 0] += 1
+    assert key != RankCache.make_key(w2, 'apoz', 'calib')
+    assert key != RankCache.make_key(w, 'entropy', 'calib')
+    assert key != RankCache.make_key(w, 'apoz', 'other')
+    assert key != RankCache.make_key(w.astype('float64'), 'apoz', 'calib')
+    assert key != RankCache.make_key(w.reshape(4, 27), 'apoz', 'calib')
+
+
+def _build_manager():
+    net = nn.HybridSequential()
+    with net.name_scope():
+        net.add(nn.Conv2D(4, 3, padding=1, in_channels=3), nn.BatchNorm(in_channels=4), nn.Activation('relu'),
+                nn.Conv2D(4, 3, padding=1, in_channels=4), nn.BatchNorm(in_channels=4), nn.Activation('relu'))
+    net.initialize()
+    manager = PrunerManager(net)
+    manager.compose(ActivationAPoZRankPruner(net[0], net[1], net[2]),
+                    ActivationAPoZRankPruner(net[3], net[4], net[5]))
+    manager.build((2, 3, 8, 8))
+    return net, manager
+
+
+def test_load_or_compute_ranking(tmp_path):
+    conv = nn.Conv2D(4, 3, in_channels=3)
+    bn = nn.BatchNorm(in_channels=4)
+    conv.initialize()
+    bn.initialize()
+    pruner = WeightL1RankPruner(conv, bn)
+    pruner.set_rank_cache(RankCache(str(tmp_path)))
+    calls = []
+    def _compute():
+        calls.append(1)
+        return {'rank': np.arange(4.)}
+
+    np.testing.assert_array_equal(pruner._load_or_compute_ranking(_compute)['rank'], np.arange(4.))
+    np.testing.assert_array_equal(pruner._load_or_compute_ranking(_compute)['rank'], np.arange(4.))
+    assert len(calls) == 1
+    # Key changes with weights
+    conv.weight.set_data(conv.weight.data() + 1)
+    pruner._load_or_compute_ranking(_compute)
+    assert len(calls) == 2
+
+
+def test_data_dependent_needs_calib_id_and_digest(tmp_path):
+    _, manager = _build_manager()
+    pruner = manager.pruner_list[0]
+    pruner.set_rank_cache(RankCache(str(tmp_path)))
+    pruner.bind_digest('digest')
+    assert pruner._ranking_key() is None
+    pruner.set_rank_cache(RankCache(str(tmp_path)), calib_id='calib')
+    assert pruner._ranking_key() is None
+    pruner.bind_digest('digest')
+    assert pruner._ranking_key() is not None
+
+
+def test_prune_without_calibration_raises():
+    _, manager = _build_manager()
+    manager.apply(lambda pruner: pruner.clear_state())
+    with pytest.raises(AssertionError):
+        manager.prune(.5)
+
+
+def test_sweep_hits_after_reset_masks(tmp_path):
+    net, manager = _build_manager()
+    manager.set_rank_cache(RankCache(str(tmp_path)), calib_id='calib')
+    x = nd.random.uniform(-1, 1, shape=(2, 3, 8, 8))
+
+    manager.reset_masks()
+    assert not manager.rankings_cached()
+    net(x)
+    manager.prune(.5)
+    masks = [pruner.mask.asnumpy() for pruner in manager.pruner_list]
+    net(x)
+    manager.analyse()
+
+    # Masks changed without reset, so the net state differs from calibration
+    assert not manager.rankings_cached()
+
+    manager.reset_masks()
+    assert manager.rankings_cached()
+    manager.prune(.5)
+    for pruner, mask in zip(manager.pruner_list, masks):
+        np.testing.assert_array_equal(pruner.mask.asnumpy(), mask)
+
+
+def test_digest_ignores_net_prefix():
+    net1, manager1 = _build_manager()
+    net2, manager2 = _build_manager()
+    assert net1.prefix != net2.prefix
+    for p1, p2 in zip(net1.collect_params().values(), net2.collect_params().values()):
+        p2.set_data(p1.data())
+    assert manager1.net_digest() == manager2.net_digest()